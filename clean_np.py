@@ -11,6 +11,12 @@ And process the noun phrases to filter out phrases
 (ii)  has any token that is a stopword
 (iii) the first and last word in phrase is not a punctuation
 
+If the noun phrases come from `senna.py --np test.txt --tagged`, i.e. each 
+token carries SENNA's POS tag as "word#POS", add `--tagged` so that those tags
+are used for (i) and the phrases are not re-tagged:
+
+	python3 nltk_cli/clean_np.py test.tagged.np --tagged
+
 This is part of the Terminator software from 
 https://github.com/alvations/Terminator (Tan, 2015)
 
@@ -18,6 +24,18 @@ Usage:
 
 	python3 nltk_cli/clean_np.py test.np --output test.filtered.np
 
+To filter a large file on N cores, add `--workers N`; the file is split into 
+chunks at line boundaries and filtered in N processes. The output is in input
+order unless `--unordered` is given, which is faster:
+
+	python3 nltk_cli/clean_np.py test.np --workers 8 --unordered
+
+To extract and filter the noun phrases from raw text without SENNA, use 
+`--extract`; the sentences are tagged with PerceptronTagger and the phrases
+whose tags match a tag-sequence pattern, by default '(JJ|NN)*NN', are kept:
+
+	python3 nltk_cli/clean_np.py --extract test.txt --pattern '(JJ|NN)*NN'
+
 Reference:
 
 Liling Tan. 2015. EXPERT Innovations in Terminology Extraction and 
@@ -25,48 +43,201 @@ Ontology Induction. In Proceedings of Proceedings of the EXPERT Scientific
 and Technological Workshop. Malaga, Spain.
 """
 
-import io, sys
+import io, os, re, sys
+from bisect import bisect_right
+from multiprocessing import Pool
 from os.path import expanduser
 from string import punctuation
 
-from nltk.util import ngrams
 from nltk.corpus import stopwords
 from nltk import word_tokenize
 from nltk.tag import PerceptronTagger
 
-tagger = PerceptronTagger()
-pos_tag = tagger.tag
 STOPWORDS = stopwords.words('english')
-
-def simple_filter(list_of_ngrams):
-    return [ng for ng in list_of_ngrams if
+TAGGED_TOKEN = re.compile(r'^(.+)#(.+)$')
+CHUNK_BYTES = 64 * 1024 * 1024
+NP_PATTERN = '(JJ|NN)*NN'
+
+tagger = None
+
+def get_tagger():
+    # The tagger is only loaded when some phrases come without POS tags.
+    global tagger
+    if tagger is None:
+        tagger = PerceptronTagger()
+    return tagger
+
+def pos_tag(tokens):
+    return get_tagger().tag(tokens)
+
+def pos_tag_sents(sentences):
+    return get_tagger().tag_sents(sentences)
+
+def split_tags(ng):
+    """
+    Splits a "word#POS word#POS" phrase into the plain phrase and its tags,
+    returns (ng, None) if some token has no tag. Only use it on phrases that 
+    are known to be tagged, an untagged "issue#42" would pass for tagged.
+    """
+    matches = [TAGGED_TOKEN.match(token) for token in ng.split()]
+    if matches and all(matches):
+        return " ".join(m.group(1) for m in matches), [m.group(2) for m in matches]
+    return ng, None
+
+def has_noun(ng, tags=None):
+    if tags is None:
+        tags = [pos for word,pos in pos_tag(ng.lower().split())]
+    return any(pos for pos in tags if pos.startswith('NN'))
+
+def simple_filter(list_of_ngrams, tagged=False):
+    if tagged:
+        list_of_ngrams = map(split_tags, list_of_ngrams)
+    else:
+        list_of_ngrams = [(ng, None) for ng in list_of_ngrams]
+    return [ng for ng, tags in list_of_ngrams if
             ng.lower() not in STOPWORDS and
             ng[0] not in punctuation and ng[-1] not in punctuation and
             ng.split()[-1].lower() not in STOPWORDS and
             ng.split()[0].lower() not in STOPWORDS and
             not any(i for i in ng.split() if i.lower() in STOPWORDS) and
-            any(pos for word,pos in pos_tag(ng.lower().split())
-                if pos.startswith('NN')) and
+            has_noun(ng, tags) and
             ')' not in ng and '(' not in ng and ',' not in ng and
             'pinyin' not in ng and
             ng.split()[0] not in ['more', 'less']]
 
-outfile = ""
-
-try:
-	if sys.argv[2] == '--output':
-		outfile = sys.argv[3]
-		fout = io.open(outfile, 'w', encoding='utf8')
-except IndexError:
-	pass
-
-with io.open(sys.argv[1], 'r', encoding='utf8') as fin:
-    for line in fin:
+def filter_lines(lines, tagged=False):
+    for line in lines:
         list_of_ngrams = line.split('\t')[0].split('|')
-        for ng in simple_filter(list_of_ngrams):
-        	if outfile:
-        		fout.write(ng + '\n')
-        	else:
-        		print(ng)
-
-
+        for ng in simple_filter(list_of_ngrams, tagged):
+            yield ng
+
+def compile_tag_pattern(pattern):
+    """
+    Compiles a tag-sequence pattern, e.g. '(JJ|NN)*NN', into a regex over 
+    tag sequences encoded as '<DT><JJ><NN>'. A tag in the pattern matches any
+    tag it is a prefix of, e.g. NN matches NN, NNS, NNP and NNPS.
+    """
+    pattern = re.sub(r'\s+', '', pattern)
+    return re.compile(re.sub(r'[A-Z][A-Z$]*', 
+                             lambda m: '(?:<' + re.escape(m.group()) + '[^>]*>)',
+                             pattern))
+
+def extract_candidates(sentences, pattern=NP_PATTERN, batch_size=1000):
+    """
+    Extracts the phrases whose tags match the pattern from raw sentences and 
+    filters them as simple_filter() does, in the same pass. The sentences are
+    tagged in batches with PerceptronTagger, no SENNA chunker is needed.
+    """
+    tag_pattern = compile_tag_pattern(pattern)
+    sentences = iter(sentences)
+    while True:
+        batch = [word_tokenize(sent.strip()) for _, sent in zip(range(batch_size), sentences)]
+        if not batch:
+            break
+        for tagged_sent in pos_tag_sents(batch):
+            encoded = ''.join('<' + tag + '>' for word, tag in tagged_sent)
+            # The character offset where each token's tag starts.
+            offsets, offset = [], 0
+            for word, tag in tagged_sent:
+                offsets.append(offset)
+                offset += len(tag) + 2
+            candidates = []
+            for match in tag_pattern.finditer(encoded):
+                if match.start() == match.end():
+                    continue
+                start = bisect_right(offsets, match.start()) - 1
+                end = bisect_right(offsets, match.end() - 1)
+                candidates.append(" ".join(word + '#' + tag for word, tag 
+                                           in tagged_sent[start:end]))
+            for ng in simple_filter(candidates, tagged=True):
+                yield ng
+
+def line_aligned_ranges(infile, chunk_bytes=CHUNK_BYTES):
+    """
+    Splits a file into (start, end) byte ranges of about chunk_bytes that
+    start and end on line boundaries.
+    """
+    size = os.path.getsize(infile)
+    ranges = []
+    with io.open(infile, 'rb') as fin:
+        start = 0
+        while start < size:
+            fin.seek(min(start + chunk_bytes, size))
+            fin.readline() # Move on to the end of the line.
+            end = fin.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def filter_range(task):
+    """
+    Filters the lines in a byte range of the file, each worker process loads
+    its own tagger (if needed) on first use.
+    """
+    infile, start, end, pattern, tagged = task
+    with io.open(infile, 'rb') as fin:
+        fin.seek(start)
+        chunk = fin.read(end - start)
+    # Split the lines like the serial text-mode read does, i.e. only on 
+    # (universal) newlines, not on the other separators splitlines() knows.
+    lines = list(io.TextIOWrapper(io.BytesIO(chunk), encoding='utf8'))
+    if pattern:
+        return list(extract_candidates(lines, pattern))
+    return list(filter_lines(lines, tagged))
+
+def parallel_filter(infile, workers, ordered=True, pattern=None, tagged=False):
+    """
+    Filters byte-range chunks of the file in a pool of worker processes and 
+    yields the filtered phrases, in input order unless ordered=False. With a 
+    pattern, the phrases are extracted from raw text by extract_candidates().
+    """
+    tasks = [(infile, start, end, pattern, tagged) 
+             for start, end in line_aligned_ranges(infile)]
+    pool = Pool(workers)
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for filtered in imap(filter_range, tasks):
+            for ng in filtered:
+                yield ng
+    finally:
+        pool.terminate()
+
+def main(argv):
+    # The input file is the first argument that isn't an option or its value.
+    infile = next(arg for previous, arg in zip(argv[:-1], argv[1:]) 
+                  if not arg.startswith('--') and 
+                  previous not in ('--pattern', '--output', '--workers'))
+    outfile = ""
+    workers, ordered, pattern = 1, True, None
+    if '--extract' in argv:
+        pattern = NP_PATTERN
+    if '--pattern' in argv:
+        if pattern is None:
+            sys.exit('--pattern only works with --extract, on raw text.')
+        pattern = argv[argv.index('--pattern') + 1]
+    if '--output' in argv:
+        outfile = argv[argv.index('--output') + 1]
+    if '--workers' in argv:
+        workers = int(argv[argv.index('--workers') + 1])
+    if '--unordered' in argv:
+        ordered = False
+    tagged = '--tagged' in argv
+
+    fout = io.open(outfile, 'w', encoding='utf8') if outfile else None
+    with io.open(infile, 'r', encoding='utf8') as fin:
+        if workers > 1:
+            filtered = parallel_filter(infile, workers, ordered, pattern, tagged)
+        elif pattern:
+            filtered = extract_candidates(fin, pattern)
+        else:
+            filtered = filter_lines(fin, tagged)
+        for ng in filtered:
+            if outfile:
+                fout.write(ng + '\n')
+            else:
+                print(ng)
+    if fout:
+        fout.close()
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,740 @@
+#!/usr/bin/env python3 -*- coding: utf-8 -*-
+
+"""
+Shared batching machinery for the NLTK CLI scripts.
+
+A Pipeline holds an initialized tool (e.g. a StanfordPOSTagger or a
+SennaChunkTagger) and streams sentences through it batch by batch, so that 
+Python callers don't have to shell out to stanford.py/senna.py:
+
+	>>> from stanford import Pipeline
+	>>> pipeline = Pipeline('postagger', lang='eng')
+	>>> for tagged_sent in pipeline.run(open('test.txt')):
+	...     print(tagged_sent)
+
+Note that NLTK's wrappers still start a new JVM or SENNA process, which loads
+the model, for every batch; reusing a Pipeline only saves the setup on the 
+Python side, larger batches amortize the startup over more sentences.
+"""
+
+from __future__ import print_function
+import asyncio
+import io
+from array import array
+import itertools
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from queue import Queue, Empty
+
+
+def batches(iterable, batch_size):
+	"""
+	Lazily groups an iterable into lists of at most batch_size items.
+	"""
+	batch = []
+	for item in iterable:
+		batch.append(item)
+		if len(batch) == batch_size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def prefetch(iterable, size=2):
+	"""
+	Iterates over iterable in a background thread, up to size items ahead of
+	the consumer, e.g. to read and tokenize the input while the tool runs.
+	"""
+	queue = Queue(size)
+	def produce():
+		try:
+			for item in iterable:
+				queue.put((True, item))
+		except Exception as e:
+			queue.put((False, e))
+			return
+		queue.put((False, None))
+	producer = threading.Thread(target=produce)
+	producer.daemon = True
+	producer.start()
+	while True:
+		produced, item = queue.get()
+		if not produced:
+			if item is not None:
+				raise item
+			return
+		yield item
+
+
+def follow_lines(infile, poll=0.1):
+	"""
+	Yields the lines of a file as they are appended to it, like `tail -f`; 
+	reads STDIN until it's closed if infile is '-'.
+	"""
+	if infile == '-':
+		stdin = io.open(sys.stdin.fileno(), 'r', encoding='utf8', closefd=False)
+		for line in iter(stdin.readline, ''):
+			yield line
+		return
+	with io.open(infile, 'r', encoding='utf8') as fin:
+		partial = ''
+		while True:
+			line = fin.readline()
+			if not line:
+				time.sleep(poll)
+				continue
+			partial += line
+			if partial.endswith('\n'):
+				yield partial
+				partial = ''
+
+
+def micro_batches(lines, max_lines, max_ms):
+	"""
+	Groups a live stream of lines into batches that are flushed as soon as 
+	max_lines lines have accumulated or max_ms milliseconds have passed since 
+	the first line of the batch arrived.
+	"""
+	queue = Queue()
+	def read():
+		for line in lines:
+			queue.put(line)
+		queue.put(None)
+	reader = threading.Thread(target=read)
+	reader.daemon = True
+	reader.start()
+	batch, deadline = [], None
+	while True:
+		try:
+			line = queue.get(timeout=None if deadline is None 
+							else max(0, deadline - time.time()))
+		except Empty:
+			yield batch
+			batch, deadline = [], None
+			continue
+		if line is None:
+			break
+		batch.append(line)
+		if deadline is None:
+			deadline = time.time() + max_ms / 1000.0
+		if len(batch) >= max_lines:
+			yield batch
+			batch, deadline = [], None
+	if batch:
+		yield batch
+
+
+def consume(items):
+	"""
+	Yields the items of a list and drops them from it on the way, so that 
+	each item can be freed once it has been used; the list ends up empty.
+	"""
+	items.reverse()
+	while items:
+		yield items.pop()
+
+
+class TaggedBatch(object):
+	"""
+	A compact batch of tagged sentences. Instead of a (word, tag) tuple per 
+	token, all tracked by the garbage collector, each sentence is kept as one
+	str of its words joined by newlines (which tokens never contain) and an 
+	array of ids into the batch's own table of tags.
+
+		>>> tagged_batch = TaggedBatch([[('Hello', 'UH'), ('world', 'NN')]])
+		>>> list(tagged_batch.tokens(0))
+		[('Hello', 'UH'), ('world', 'NN')]
+		>>> list(tagged_batch.formatted())
+		['Hello#UH world#NN']
+
+	The tagged sentences are only read; wrap a list in consume() to free the
+	tagger's tuples while the batch is built. The peak memory still includes
+	all the tuples, as NLTK's tag_sents() returns them at once. Reading the 
+	tokens back builds new strs, it isn't zero-copy.
+	"""
+	__slots__ = ('sent_words', 'tag_ids', 'sent_ends', 'tags')
+
+	def __init__(self, tagged_sents):
+		self.sent_words, self.tags = [], []
+		# Tag sets are way smaller than the 65536 ids an unsigned short holds.
+		self.tag_ids, self.sent_ends = array('H'), array('l')
+		tag_ids = {}
+		for tagged_sent in tagged_sents:
+			words = []
+			for word, tag in tagged_sent:
+				words.append(word)
+				tag_id = tag_ids.get(tag)
+				if tag_id is None:
+					tag_id = tag_ids[tag] = len(self.tags)
+					self.tags.append(tag)
+				self.tag_ids.append(tag_id)
+			self.sent_words.append('\n'.join(words))
+			self.sent_ends.append(len(self.tag_ids))
+
+	def __len__(self):
+		return len(self.sent_ends)
+
+	def tokens(self, i):
+		"""
+		The (word, tag) tokens of the i-th sentence.
+		"""
+		start = self.sent_ends[i-1] if i else 0
+		tags = self.tags
+		# An empty sentence splits into [''], which zip() drops.
+		return [(word, tags[tag_id]) for word, tag_id in 
+				zip(self.sent_words[i].split('\n'), self.tag_ids[start:self.sent_ends[i]])]
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self.tokens(i)
+
+	def formatted(self, sep='#'):
+		"""
+		Yields every sentence as "word#tag word#tag ...", in order.
+		"""
+		suffixes = [sep + tag for tag in self.tags]
+		start = 0
+		for words, end in zip(self.sent_words, self.sent_ends):
+			yield " ".join([word + suffixes[tag_id] for word, tag_id in 
+							zip(words.split('\n'), self.tag_ids[start:end])])
+			start = end
+
+
+REJECTED = "!!! REJECTED this sentence, the tool failed on it !!!"
+
+
+class RejectLog(object):
+	"""
+	A reject file that is opened on the first rejected sentence and can be 
+	shared by pipelines writing to it from several threads, e.g. the tools 
+	of a stanford.MultiPipeline.
+	"""
+	def __init__(self, rejectfile):
+		self.rejectfile = rejectfile
+		self.fout = None
+		self.lock = threading.Lock()
+
+	def write(self, rejected):
+		with self.lock:
+			if self.fout is None:
+				self.fout = io.open(self.rejectfile, 'w', encoding='utf8')
+			self.fout.write(rejected + '\n')
+			self.fout.flush()
+
+
+class BatchFailure(Exception):
+	"""
+	Raised when the tool times out or crashes on a batch.
+	"""
+
+
+class ToolFailure(Exception):
+	"""
+	Raised when the tool fails whatever the sentences, e.g. when java, a jar 
+	or a model can't be found; such failures aren't isolated by bisection.
+	"""
+
+
+def run_in_group(sender, func, args):
+	"""
+	The watchdog's child: leads a new process group and sends back the 
+	result of func(*args), or the error.
+	"""
+	os.setsid()
+	try:
+		sender.send((True, func(*args)))
+	except LookupError as e: # NLTK can't find java, a jar or a model.
+		sender.send((False, ('tool', repr(e))))
+	except Exception as e:
+		sender.send((False, ('batch', repr(e))))
+
+
+def watchdog_context():
+	"""
+	A multiprocessing context that starts the watchdog's children from a 
+	single-threaded fork server (or a fresh interpreter where there is none),
+	as forking this process could deadlock the child on a lock held by one of 
+	the reader, warmup or executor threads.
+	"""
+	if 'forkserver' not in multiprocessing.get_all_start_methods():
+		return multiprocessing.get_context('spawn')
+	context = multiprocessing.get_context('forkserver')
+	# Import the script (and thereby NLTK) once in the server, not per child.
+	context.set_forkserver_preload(['__main__', 'pipeline'])
+	return context
+
+
+def run_with_timeout(func, args, timeout):
+	"""
+	Runs func(*args) in a child process that leads its own process group, so 
+	that a hanging SENNA process or Stanford JVM started by the tool can be 
+	killed together with it once the timeout (in seconds) runs out; func and 
+	args are pickled to the child.
+	"""
+	context = watchdog_context()
+	receiver, sender = context.Pipe(duplex=False)
+	child = context.Process(target=run_in_group, args=(sender, func, args))
+	try:
+		child.start()
+	except Exception as e: # E.g. func or args can't be pickled.
+		sender.close()
+		receiver.close()
+		raise ToolFailure('Could not start the watchdog\'s child: ' + repr(e))
+	sender.close()
+	try:
+		if not receiver.poll(timeout):
+			raise BatchFailure('Timed out after ' + str(timeout) + ' seconds')
+		succeeded, result = receiver.recv()
+	except EOFError:
+		child.join()
+		raise BatchFailure('The tool crashed with exit code ' + str(child.exitcode))
+	finally:
+		try:
+			os.killpg(child.pid, signal.SIGKILL)
+		except OSError: # Already gone, or not a group leader yet.
+			child.kill()
+		child.join()
+		receiver.close()
+	if not succeeded:
+		failure, error = result
+		raise (ToolFailure if failure == 'tool' else BatchFailure)(error)
+	return result
+
+
+class NERPrefilter(object):
+	"""
+	Decides which sentences may contain named entities, so that only those 
+	go to the NER tagger and the rest are tagged all 'O' directly. A sentence 
+	is a candidate if any token matches candidate_regex (by default, any token
+	with an uppercase letter or a digit) or is in the gazetteer, a set of 
+	lowercased words.
+
+	In audit mode the skipped sentences are tagged anyway to count the entity
+	tokens the prefilter would miss, i.e. its recall loss.
+	"""
+	def __init__(self, candidate_regex=None, gazetteer=(), audit=False):
+		self.candidate_regex = candidate_regex and re.compile(candidate_regex)
+		self.gazetteer = set(word.lower() for word in gazetteer)
+		self.audit = audit
+		self.sentences, self.skipped = 0, 0
+		self.entity_tokens, self.missed_entity_tokens = 0, 0
+
+	def is_candidate_token(self, token):
+		if token.lower() in self.gazetteer:
+			return True
+		if self.candidate_regex:
+			return bool(self.candidate_regex.search(token))
+		return any(char.isupper() or char.isdigit() for char in token)
+
+	def is_candidate(self, sentence):
+		return any(self.is_candidate_token(token) for token in sentence)
+
+	def count_entity_tokens(self, processed_sents):
+		return sum(token.rsplit('#', 1)[-1] != 'O' 
+					for processed_sent in processed_sents
+					for token in processed_sent.split())
+
+	def report(self):
+		skip_rate = self.skipped / float(self.sentences) if self.sentences else 0.0
+		report = ('NER prefilter skipped ' + str(self.skipped) + ' of ' + 
+				str(self.sentences) + ' sentences ({:.1%})'.format(skip_rate))
+		if self.audit:
+			recall_loss = (self.missed_entity_tokens / float(self.entity_tokens) 
+							if self.entity_tokens else 0.0)
+			report += (', missing ' + str(self.missed_entity_tokens) + ' of ' + 
+					str(self.entity_tokens) + ' entity tokens '
+					'({:.1%} recall loss)'.format(recall_loss))
+		return report
+
+
+def read_gazetteer(gazetteerfile):
+	"""
+	Reads the words of a gazetteer file with one entry per line.
+	"""
+	with io.open(gazetteerfile, 'r', encoding='utf8') as fin:
+		return [word for line in fin for word in line.split()]
+
+
+def all_outside(sentence):
+	return " ".join(token + '#O' for token in sentence)
+
+
+class Pipeline(object):
+	"""
+	Wraps an initialized tool and its process function, e.g.
+	(StanfordPOSTagger, stanford_tag_sents), where the process function takes
+	a list of tokenized sentences and the tool (plus any process_args) and
+	yields one output string per sentence.
+
+	If a timeout (in seconds) or a reject file (a path or a shared RejectLog)
+	is given, every batch runs under a watchdog and a failing batch is 
+	bisected until the offending sentences are isolated; those are written to
+	the reject file (or stderr), prefixed with the pipeline's name if it has 
+	one, and replaced by a placeholder in the output, the rest is kept.
+	If the tool fails on each of the first fail_fast sentences it's given 
+	alone before any batch succeeded, the tool itself is broken (e.g. a bad 
+	jar) and a ToolFailure is raised instead.
+
+	If a bucket_window is given, that many sentences are read ahead and sorted
+	by length, longest first, before they are cut into batches, so that 
+	similar-length sentences are batched together; the outputs are still
+	returned in input order.
+
+	For NER taggers, a NERPrefilter can be given to skip the sentences 
+	without entity candidates.
+	"""
+	def __init__(self, tool, process, process_args=(), batch_size=1000,
+				tokenize=str.split, timeout=None, reject=None, 
+				bucket_window=None, prefilter=None, name=None):
+		self.tool = tool
+		self.process = process
+		self.process_args = tuple(process_args)
+		self.batch_size = batch_size
+		self.tokenize = tokenize
+		self.timeout = timeout
+		# Only the path, the RejectLog's lock and file can't be pickled.
+		self.reject = reject.rejectfile if isinstance(reject, RejectLog) else reject
+		self.isolate = timeout is not None or reject is not None
+		self.fail_fast = 2
+		self.succeeded, self.failed_alone = False, 0
+		self._reject_log = (reject if isinstance(reject, RejectLog) else 
+							reject and RejectLog(reject))
+		self.name = name
+		self.bucket_window = bucket_window
+		self.prefilter = prefilter
+		self._warmup = None
+		self.stats = {}
+
+	def tokenize_sents(self, sentences):
+		"""
+		Lazily tokenizes raw strings, token lists are passed through as-is.
+		"""
+		for sent in sentences:
+			if isinstance(sent, str):
+				sent = self.tokenize(sent.strip())
+			yield sent
+
+	def __getstate__(self):
+		"""
+		Leaves out the threads and open files, so that the pipeline can be 
+		pickled to the watchdog's child process.
+		"""
+		state = dict(self.__dict__)
+		state['_warmup'] = state['_reject_log'] = None
+		return state
+
+	def process_batch(self, batch):
+		"""
+		Runs the tool over one list of tokenized sentences.
+		"""
+		return list(self.process(batch, self.tool, *self.process_args))
+
+	def warmup_files(self):
+		"""
+		The files the tool loads when it starts, e.g. its jars, binaries and 
+		models; subclasses know which.
+		"""
+		return []
+
+	def warmup(self):
+		"""
+		Asks the OS to read the tool's files into the page cache, so that the 
+		JVM or SENNA process of the first batch loads them from memory. The tool
+		itself isn't run, as NLTK would start a new process for every batch 
+		anyway, and the first batch doesn't wait for this.
+		"""
+		if not hasattr(os, 'posix_fadvise'):
+			return
+		for filename in self.warmup_files():
+			try:
+				fd = os.open(filename, os.O_RDONLY)
+				try:
+					os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+				finally:
+					os.close(fd)
+			except OSError as e:
+				print('Could not warm up ' + filename + ': ' + str(e), file=sys.stderr)
+
+	def start_warmup(self):
+		"""
+		Warms the tool up in a background thread while the input is read.
+		"""
+		self._warmup = threading.Thread(target=self.warmup)
+		self._warmup.daemon = True
+		self._warmup.start()
+
+	def process_batch_safely(self, batch, indices):
+		"""
+		Runs process_batch() under the watchdog and bisects the batch on 
+		failure, indices are the positions of the batch's sentences in the input.
+		"""
+		try:
+			if self.timeout is not None:
+				processed_sents = run_with_timeout(self.process_batch, (batch,), self.timeout)
+			else:
+				processed_sents = self.process_batch(batch)
+		except (ToolFailure, LookupError):
+			raise
+		except Exception as e:
+			if not self.isolate:
+				raise
+			if len(batch) == 1:
+				if not self.succeeded:
+					self.failed_alone += 1
+					if self.failed_alone >= self.fail_fast:
+						raise ToolFailure('The tool failed on each of the first ' + 
+										str(self.failed_alone) + ' sentences, '
+										'giving up: ' + str(e))
+				self.reject_sentence(batch[0], indices[0], e)
+				return [REJECTED]
+			half = len(batch) // 2
+			return (self.process_batch_safely(batch[:half], indices[:half]) + 
+					self.process_batch_safely(batch[half:], indices[half:]))
+		self.succeeded = True
+		return processed_sents
+
+	def process_window(self, window, offset=0):
+		"""
+		Processes a window of sentences and returns the outputs in order, 
+		offset is the index of the window's first sentence in the input.
+		"""
+		indices = list(range(offset, offset + len(window)))
+		if self.prefilter is None:
+			return self.process_sents(window, indices)
+		candidates = [self.prefilter.is_candidate(sent) for sent in window]
+		candidate_sents, candidate_indices, skipped_sents, skipped_indices = [], [], [], []
+		for sent, index, candidate in zip(window, indices, candidates):
+			if candidate:
+				candidate_sents.append(sent)
+				candidate_indices.append(index)
+			else:
+				skipped_sents.append(sent)
+				skipped_indices.append(index)
+		processed_candidates = self.process_sents(candidate_sents, candidate_indices)
+		self.prefilter.sentences += len(window)
+		self.prefilter.skipped += len(skipped_sents)
+		if self.prefilter.audit:
+			missed = self.prefilter.count_entity_tokens(
+							self.process_sents(skipped_sents, skipped_indices))
+			self.prefilter.missed_entity_tokens += missed
+			self.prefilter.entity_tokens += (missed + 
+							self.prefilter.count_entity_tokens(processed_candidates))
+		processed_candidates = iter(processed_candidates)
+		return [next(processed_candidates) if candidate else all_outside(sent)
+				for sent, candidate in zip(window, candidates)]
+
+	def process_sents(self, sents, indices):
+		"""
+		Processes sentences batch by batch and returns the outputs in order, 
+		indices are the positions of the sentences in the input.
+		"""
+		order = list(range(len(sents)))
+		if self.bucket_window:
+			order.sort(key=lambda i: len(sents[i]), reverse=True)
+		processed_sents = [None] * len(sents)
+		start = 0
+		while start < len(order):
+			# The batch size is re-read for every batch as it may be adapted.
+			batch_order = order[start:start + self.batch_size]
+			batch = [sents[i] for i in batch_order]
+			batch_indices = [indices[i] for i in batch_order]
+			for i, processed_sent in zip(batch_order, 
+								self.process_batch_safely(batch, batch_indices)):
+				processed_sents[i] = processed_sent
+			start += len(batch_order)
+		return processed_sents
+
+	def windows(self, sentences):
+		"""
+		Lazily yields (offset, window) of tokenized sentences, which are read 
+		and tokenized ahead in a background thread. The first window is a 
+		single batch so that the first outputs come out as soon as it's done.
+		"""
+		sentences = self.tokenize_sents(sentences)
+		first_window = list(itertools.islice(sentences, self.batch_size))
+		window_iter = itertools.chain([first_window] if first_window else [],
+						batches(sentences, self.bucket_window or self.batch_size))
+		offset = 0
+		for window in prefetch(window_iter):
+			yield offset, window
+			offset += len(window)
+
+	def start_stats(self):
+		self.stats = {'sentences': 0, 'seconds': 0.0, 'time_to_first_output': None,
+					'started': time.time()}
+
+	def update_stats(self, window):
+		self.stats['sentences'] += len(window)
+		self.stats['seconds'] = time.time() - self.stats['started']
+
+	def first_output(self):
+		"""
+		Records the time to first output, once the first outputs have been 
+		handed over (or written and flushed, see write_outputs()).
+		"""
+		if self.stats.get('time_to_first_output') is None:
+			self.stats['time_to_first_output'] = time.time() - self.stats['started']
+
+	def report(self):
+		"""
+		A report of the last run's throughput and time to first output.
+		"""
+		stats = self.stats
+		report = 'Processed ' + str(stats.get('sentences', 0)) + ' sentences'
+		if stats.get('sentences'):
+			report += (' in {:.2f} seconds ({:.2f} sentences/sec), first output '
+					'after {:.2f} seconds').format(stats['seconds'], 
+					stats['sentences'] / max(stats['seconds'], 1e-9), 
+					stats['time_to_first_output'])
+		if self.prefilter is not None:
+			report += '\n' + self.prefilter.report()
+		return report
+
+	def reject_sentence(self, sentence, index, error):
+		"""
+		Records a sentence the tool failed on as "index\tsentence\terror", or 
+		as "name\tindex\tsentence\terror" if the pipeline has a name.
+		"""
+		rejected = str(index) + '\t' + " ".join(sentence) + '\t' + str(error)
+		if self.name:
+			rejected = self.name + '\t' + rejected
+		if self._reject_log:
+			self._reject_log.write(rejected)
+		else:
+			print(rejected, file=sys.stderr)
+
+	def run_windows(self, sentences):
+		"""
+		Like run() but yields the outputs window by window, as lists.
+		"""
+		self.start_stats()
+		for offset, window in self.windows(sentences):
+			processed_sents = self.process_window(window, offset)
+			self.update_stats(window)
+			yield processed_sents
+
+	def run(self, sentences):
+		"""
+		Returns a lazy generator of outputs, one per input sentence.
+		"""
+		for processed_sents in self.run_windows(sentences):
+			self.first_output()
+			for processed_sent in processed_sents:
+				yield processed_sent
+
+	__call__ = run
+
+	def stream_windows(self, lines, flush_lines=100, flush_ms=200):
+		"""
+		Like stream() but yields the outputs micro-batch by micro-batch, as lists.
+		"""
+		self.start_stats()
+		offset = 0
+		for window in micro_batches(lines, flush_lines, flush_ms):
+			window = list(self.tokenize_sents(window))
+			processed_sents = self.process_window(window, offset)
+			self.update_stats(window)
+			yield processed_sents
+			offset += len(window)
+
+	def stream(self, lines, flush_lines=100, flush_ms=200):
+		"""
+		Like run() but for live input, e.g. from follow_lines(); a micro-batch 
+		goes to the tool once flush_lines lines or flush_ms milliseconds have
+		accumulated, which bounds the latency of every line.
+		"""
+		for processed_sents in self.stream_windows(lines, flush_lines, flush_ms):
+			self.first_output()
+			for processed_sent in processed_sents:
+				yield processed_sent
+
+	async def arun(self, sentences):
+		"""
+		Asynchronous variant of run(); reading the input and processing each 
+		batch run in the event loop's default executor so the loop isn't 
+		blocked by the input or the tool.
+		"""
+		loop = asyncio.get_running_loop()
+		self.start_stats()
+		windows = self.windows(sentences)
+		while True:
+			offset_window = await loop.run_in_executor(None, next, windows, None)
+			if offset_window is None:
+				break
+			offset, window = offset_window
+			processed_sents = await loop.run_in_executor(None,
+									self.process_window, window, offset)
+			self.update_stats(window)
+			self.first_output()
+			for processed_sent in processed_sents:
+				yield processed_sent
+
+
+def pipeline_options(arguments):
+	"""
+	Maps the shared command line options to Pipeline keyword arguments.
+	"""
+	options = {}
+	if arguments.get('--timeout'):
+		options['timeout'] = float(arguments['--timeout'])
+	if arguments.get('--reject'):
+		options['reject'] = arguments['--reject']
+	if arguments.get('--bucket-window'):
+		options['bucket_window'] = int(arguments['--bucket-window'])
+	if arguments.get('--prefilter'):
+		options['prefilter'] = NERPrefilter(arguments.get('--candidate-regex'),
+								read_gazetteer(arguments['--gazetteer']) 
+								if arguments.get('--gazetteer') else (),
+								audit=arguments.get('--audit'))
+	return options
+
+
+def write_outputs(processed_windows, outfile="", flush_every_window=False, 
+				first_output=None):
+	"""
+	Writes the outputs, window by window, to outfile or STDOUT if no outfile
+	is given. The first window (or every window with flush_every_window) is 
+	flushed as soon as it's written, then first_output() is called, e.g. 
+	Pipeline.first_output to record the time to first output.
+	"""
+	fout = io.open(outfile, 'w', encoding='utf8') if outfile else sys.stdout
+	try:
+		for i, processed_sents in enumerate(processed_windows):
+			for processed_sent in processed_sents:
+				fout.write(processed_sent + '\n')
+			if i == 0 or flush_every_window:
+				fout.flush()
+			if i == 0 and first_output is not None:
+				first_output()
+	finally:
+		if outfile:
+			fout.close()
+
+
+def run_command(cli_pipeline, infile, outfile, arguments):
+	"""
+	Runs a pipeline over the input file from the command line, or streams the 
+	lines from STDIN (when FILE is '-') or from a growing file with --follow.
+	The tool's files are read ahead while the input is being read.
+	"""
+	cli_pipeline.start_warmup()
+	if infile == '-' or arguments.get('--follow'):
+		processed_windows = cli_pipeline.stream_windows(follow_lines(infile), 
+										int(arguments.get('--flush-lines') or 100),
+										int(arguments.get('--flush-ms') or 200))
+		write_outputs(processed_windows, outfile, flush_every_window=True,
+					first_output=cli_pipeline.first_output)
+	else:
+		with io.open(infile, 'r', encoding='utf8') as fin:
+			write_outputs(cli_pipeline.run_windows(fin), outfile, 
+						first_output=cli_pipeline.first_output)
+	if arguments.get('--report'):
+		print(cli_pipeline.report(), file=sys.stderr)
+	elif cli_pipeline.prefilter is not None:
+		print(cli_pipeline.prefilter.report(), file=sys.stderr)
@@ -5,18 +5,18 @@
 Usage:
   senna.py (-h | --help)
   senna.py --version
-  senna.py --sennadir PATH --postag  --input FILE [--output NONE]
-  senna.py --sennadir PATH --nertag  --input FILE [--output NONE]
-  senna.py --sennadir PATH --chunktag  --input FILE [--output NONE]
-  senna.py --sennadir PATH --np FILE
-  senna.py --sennadir PATH --chunk CHUNKTYPE FILE
-  senna.py --np  FILE [--output NONE]
-  senna.py --vp  FILE [--output NONE]
-  senna.py --chunk CHUNKTYPE FILE [--output NONE]
-  senna.py --postag  FILE [--output NONE]
-  senna.py --nertag  FILE [--output NONE]
-  senna.py --chunktag  FILE [--output NONE]
-  senna.py --chunk2 CHUNKTYPES FILE
+  senna.py --sennadir PATH --postag  --input FILE [--output NONE] [options]
+  senna.py --sennadir PATH --nertag  --input FILE [--output NONE] [options]
+  senna.py --sennadir PATH --chunktag  --input FILE [--output NONE] [options]
+  senna.py --sennadir PATH --np FILE [--tagged] [options]
+  senna.py --sennadir PATH --chunk CHUNKTYPE FILE [--tagged] [options]
+  senna.py --np  FILE [--output NONE] [--tagged] [options]
+  senna.py --vp  FILE [--output NONE] [--tagged] [options]
+  senna.py --chunk CHUNKTYPE FILE [--output NONE] [--tagged] [options]
+  senna.py --postag  FILE [--output NONE] [options]
+  senna.py --nertag  FILE [--output NONE] [options]
+  senna.py --chunktag  FILE [--output NONE] [options]
+  senna.py --chunk2 CHUNKTYPES FILE [options]
   
 Options:
   -h --help     		Show this screen.
@@ -30,18 +30,47 @@ Options:
   --np  	    		TL;DR, "I just want to extract NPs from this file".
   --vp  	    		TL;DR, "I just want to extract VPs from this file".
   --chunk2 CHUNKTYPE     TL;DR, "I just want to combine CHUNKTYPES (e.g. VP+ADJP) from this file".
+  --tagged  			Keep SENNA's POS tags in the chunks, i.e. "word#POS word#POS|...".
+  --timeout SECS  		Kill and bisect a batch that takes longer than SECS seconds.
+  --reject FILE   		Write the sentences SENNA fails on to FILE (else stderr).
+  --follow  			Keep reading lines as they are appended to FILE (use FILE - for STDIN).
+  --flush-lines N  		Tag a micro-batch of a --follow/STDIN stream every N lines [default: 100].
+  --flush-ms T  		... or every T milliseconds, whichever comes first [default: 200].
+  --prefilter  			Only NER tag the sentences with entity candidates, the rest are all 'O'.
+  --candidate-regex REGEX  A token matching REGEX is an entity candidate 
+  						(default: any token with an uppercase letter or digit).
+  --gazetteer FILE  	Tokens in FILE (one entry per line) are entity candidates.
+  --audit  				NER tag the skipped sentences too and report the recall loss.
+  --report  			Report the throughput and time to first output on STDERR.
 """
 
 from __future__ import print_function
-import io
 import os
 import re
 
+import numpy
 from nltk import word_tokenize
 from nltk.tag.senna import SennaTagger, SennaNERTagger, SennaChunkTagger
+from nltk.classify.senna import Senna
 
 from docopt import docopt
 
+import pipeline
+
+class SennaTaggedChunkTagger(SennaChunkTagger):
+	"""
+	A SennaChunkTagger that keeps the POS tags SENNA computes alongside the 
+	chunk tags, tag_sents() returns (word, pos, chunk) triples.
+	"""
+	def __init__(self, path, encoding='utf-8'):
+		Senna.__init__(self, path, ['pos', 'chk'], encoding)
+
+	def tag_sents(self, sentences):
+		tagged_sents = Senna.tag_sents(self, sentences)
+		return [[(annotations['word'], annotations['pos'], annotations['chk']) 
+				for annotations in sent] for sent in tagged_sents]
+
+
 senna_tool = {
 '--postag': SennaTagger,
 '--nertag': SennaNERTagger,
@@ -53,8 +82,24 @@ senna_tool = {
 
 def initialize_tool(arguments):
 	process = next(k for k,v in arguments.items() if k in senna_tool and v)
-	tool = senna_tool[process](arguments['--sennadir'])
+	if process == '--chunk' and arguments.get('--tagged'):
+		tool = SennaTaggedChunkTagger(arguments['--sennadir'])
+	else:
+		tool = senna_tool[process](arguments['--sennadir'])
 	return tool, process
+
+def initialize_process(arguments):
+	"""
+	Returns the process function and its chunk type argument for the command.
+	"""
+	if arguments['--chunk'] and arguments.get('--tagged'):
+		return senna_extract_tagged_chunks, arguments['--chunk']
+	elif arguments['--chunk']:
+		return senna_extract_chunks, arguments['--chunk']
+	elif arguments['--chunk2']:
+		return senna_extract_combined_chunks, arguments['--chunk2']
+	else:
+		return senna_tag_sents, None
 	
 def augment_arguments(arguments):
 	if arguments['--sennadir'] is None:
@@ -78,43 +123,150 @@ def initialize_iofiles(arugments):
 	
 
 def senna_tag_sents(sentences, tool, chunk_type=None):
-	tagged_sents = tool.tag_sents(sentences)
-	for sent in tagged_sents:
-		yield " ".join(word + '#' + pos for word, pos in sent)
+	tagged_batch = pipeline.TaggedBatch(pipeline.consume(tool.tag_sents(sentences)))
+	for tagged_sent in tagged_batch.formatted():
+		yield tagged_sent
+
+def batch_bio_spans(tagged_sents, chunk_types):
+	"""
+	Finds the chunks of all chunk_types in a batch of chunk tagged sentences,
+	i.e. lists of (word, chunk) or (word, pos, chunk) tuples, in one vectorized
+	pass over the whole batch. Like SennaChunkTagger.bio_to_chunks(), a chunk
+	is a maximal run of tokens whose chunk tag contains '-' + chunk_type.
+
+	Returns an integer array with one (sentence, start, end, type) row per 
+	chunk, where end is exclusive and type indexes chunk_types; the rows are
+	sorted by sentence and start.
+	"""
+	tag_ids = {}
+	lengths = numpy.fromiter((len(sent) for sent in tagged_sents), dtype=numpy.int64,
+							count=len(tagged_sents))
+	codes = numpy.fromiter((tag_ids.setdefault(token[-1], len(tag_ids)) 
+							for sent in tagged_sents for token in sent), 
+							dtype=numpy.int64, count=int(lengths.sum()))
+	tags = sorted(tag_ids, key=tag_ids.get)
+	# Which chunk tag belongs to which chunk type, then which token does.
+	members = numpy.array([['-' + chunk_type in tag for tag in tags] 
+							for chunk_type in chunk_types], dtype=bool)
+	in_chunk = members[:, codes]
+	offsets = numpy.concatenate(([0], numpy.cumsum(lengths)))
+	sent_starts = numpy.zeros(len(codes) + 1, dtype=bool)
+	sent_starts[offsets] = True
+	before = numpy.zeros_like(in_chunk)
+	before[:, 1:] = in_chunk[:, :-1]
+	after = numpy.zeros_like(in_chunk)
+	after[:, :-1] = in_chunk[:, 1:]
+	begins = in_chunk & (~before | sent_starts[:-1])
+	ends = in_chunk & (~after | sent_starts[1:])
+	types, starts = numpy.nonzero(begins)
+	_, stops = numpy.nonzero(ends)
+	sents = numpy.searchsorted(offsets, starts, side='right') - 1
+	spans = numpy.stack([sents, starts - offsets[sents], 
+						stops + 1 - offsets[sents], types], axis=1)
+	return spans[numpy.lexsort((spans[:, 1], spans[:, 0]))]
+
+def spans_by_sentence(spans, num_sents):
+	"""
+	Splits the rows of batch_bio_spans() into one array per sentence.
+	"""
+	bounds = numpy.searchsorted(spans[:, 0], numpy.arange(num_sents + 1))
+	return [spans[bounds[i]:bounds[i+1]] for i in range(num_sents)]
 
 def senna_extract_chunks(sentences, chunker, chunk_type):
 	tagged_sents = chunker.tag_sents(sentences)
-	for tagged_sent in tagged_sents:
-		chunk_outputs = list(chunker.bio_to_chunks(tagged_sent, chunk_type))
-		if chunk_outputs:
-			chunks, positions = zip(*chunk_outputs)
-			yield "|".join(chunks)
+	spans = batch_bio_spans(tagged_sents, [chunk_type])
+	for tagged_sent, sent_spans in zip(tagged_sents, 
+								spans_by_sentence(spans, len(tagged_sents))):
+		if len(sent_spans):
+			yield "|".join(" ".join(word for word, chk in tagged_sent[start:end])
+							for _, start, end, _ in sent_spans)
+		else:
+			yield str("!!! NO CHUNK of " + chunk_type + " in this sentence !!!")
+
+def senna_extract_tagged_chunks(sentences, chunker, chunk_type):
+	"""
+	Same as senna_extract_chunks() but every token in the chunks carries its 
+	SENNA POS tag, e.g. "the#DT airspeed#NN|an#DT unladen#JJ swallow#NN".
+	"""
+	tagged_sents = chunker.tag_sents(sentences)
+	spans = batch_bio_spans(tagged_sents, [chunk_type])
+	for tagged_sent, sent_spans in zip(tagged_sents, 
+								spans_by_sentence(spans, len(tagged_sents))):
+		if len(sent_spans):
+			yield "|".join(" ".join(word + '#' + pos 
+									for word, pos, chk in tagged_sent[start:end])
+							for _, start, end, _ in sent_spans)
 		else:
 			yield str("!!! NO CHUNK of " + chunk_type + " in this sentence !!!")
 
 def senna_extract_combined_chunks(sentences, chunker, chunk_types):
+	"""
+	Extracts the pairs of a chunk of the first type directly followed by a 
+	chunk of the second type, e.g. VP+ADJP, as "chunk1\tchunk2|...".
+	"""
 	_chunk_types = chunk_types.split('+')
 	tagged_sents = chunker.tag_sents(sentences)
-
-	for tagged_sent in tagged_sents:
-		chunks1 = list(chunker.bio_to_chunks(tagged_sent, _chunk_types[0]))
-		chunks2 = list(chunker.bio_to_chunks(tagged_sent, _chunk_types[1]))
-
-		chunk_combinations = []
-		jumper = 0
-		for chunk1 in chunks1:
-			chunk1_end_position = int(chunk1[1].split('-')[-1])
-			for i, chunk2 in enumerate(chunks2[jumper:]):
-				chunk2_start_position = int(chunk2[1].split('-')[0])
-				if chunk2_start_position == chunk1_end_position+1:
-					jumper = i
-					chunks, positions = zip(*[chunk1, chunk2])
-					chunk_combinations.append("\t".join(chunks))
-		if chunk_combinations:
-			yield ('|'.join(chunk_combinations))
+	spans = batch_bio_spans(tagged_sents, _chunk_types[:2])
+	firsts, seconds = spans[spans[:, 3] == 0], spans[spans[:, 3] == 1]
+	# Pair up the chunks by (sentence, position) keys, the end of a first 
+	# chunk has to be the start of a second chunk.
+	width = max(len(sent) for sent in tagged_sents) + 1 if tagged_sents else 1
+	first_keys = firsts[:, 0] * width + firsts[:, 2]
+	second_keys = seconds[:, 0] * width + seconds[:, 1]
+	found = numpy.searchsorted(second_keys, first_keys)
+	found = numpy.minimum(found, max(len(second_keys) - 1, 0))
+	matched = (second_keys[found] == first_keys if len(second_keys) 
+				else numpy.zeros(len(first_keys), dtype=bool))
+	pairs = numpy.concatenate((firsts[matched][:, :3], 
+								seconds[found[matched]][:, 1:3]), axis=1)
+	for tagged_sent, sent_pairs in zip(tagged_sents, 
+								spans_by_sentence(pairs, len(tagged_sents))):
+		if len(sent_pairs):
+			yield '|'.join(" ".join(word for word, chk in tagged_sent[start1:end1]) 
+							+ "\t" + 
+							" ".join(word for word, chk in tagged_sent[start2:end2])
+							for _, start1, end1, start2, end2 in sent_pairs)
 		else:
 			yield str("!!! NO CHUNK of " + chunk_types + " in this sentence !!!")
-			
+
+senna_options = ['--sennadir', '--postag', '--nertag', '--chunktag', 
+				'--chunk', '--chunk2', '--np', '--vp']
+
+
+class Pipeline(pipeline.Pipeline):
+	"""
+	A SENNA tool that can be reused across many calls, where tool is one of
+	the command line options without dashes, e.g.
+
+		>>> pipeline = Pipeline('np')
+		>>> pipeline = Pipeline('chunk2', chunk_type='VP+ADJP')
+		>>> list(pipeline.run(['The quick brown fox jumps over the lazy dog.']))
+
+	NLTK still starts a new SENNA process for every batch, see pipeline.py.
+	Other options (batch_size, timeout, reject) go to pipeline.Pipeline.
+	"""
+	def __init__(self, tool, sennadir=None, chunk_type=None, tagged=False,
+				**options):
+		arguments = dict.fromkeys(senna_options)
+		arguments['--sennadir'] = sennadir
+		arguments['--tagged'] = tagged
+		arguments['--' + tool] = chunk_type or True
+		if options.get('prefilter') and tool != 'nertag':
+			raise ValueError('The NER prefilter only works with --nertag.')
+		augment_arguments(arguments)
+		self.arguments = arguments
+		_tool, _ = initialize_tool(arguments)
+		process, chunk_type = initialize_process(arguments)
+		super(Pipeline, self).__init__(_tool, process, (chunk_type,),
+									tokenize=word_tokenize, **options)
+
+	def warmup_files(self):
+		sennadir = self.arguments['--sennadir']
+		files = [self.tool.executable(sennadir)]
+		for datadir in ('data', 'hash'):
+			for root, _, filenames in os.walk(os.path.join(sennadir, datadir)):
+				files += [os.path.join(root, filename) for filename in filenames]
+		return files
 
 
 if __name__ == '__main__':
@@ -122,25 +274,10 @@ if __name__ == '__main__':
 	# Augment arguments for TL;DR commands.
 	augment_arguments(arguments)
 	# Initialize tool.
-	tool, process = initialize_tool(arguments)
+	tool = next(k for k in senna_options if k != '--sennadir' and arguments[k])
+	senna_pipeline = Pipeline(tool[2:], sennadir=arguments['--sennadir'],
+							chunk_type=arguments['--chunk'] or arguments['--chunk2'],
+							tagged=arguments['--tagged'],
+							**pipeline.pipeline_options(arguments))
 	infile, outfile = initialize_iofiles(arguments)
-	# Initialize output file.
-	if outfile:
-		fout = io.open(outfile, 'w', encoding='utf8')
-		
-	if arguments['--chunk']:
-		process = senna_extract_chunks
-	elif arguments['--chunk2']:
-		process = senna_extract_combined_chunks
-		arguments['--chunk'] = arguments['--chunk2']
-	else:
-		process = senna_tag_sents
-			
-	with io.open(infile, 'r', encoding='utf8') as fin:	
-		sentences = [word_tokenize(line.strip()) for line in fin]
-		for processed_sent in process(sentences, tool, arguments['--chunk']):
-			if outfile:
-				fout.write(processed_sent + '\n')
-			else:
-				print(processed_sent)
-
+	pipeline.run_command(senna_pipeline, infile, outfile, arguments)
@@ -3,19 +3,23 @@
 """NLTK Command Line Interface - Stanford API
 
 Usage:
-  stanford.py --tool=postagger --jar FILE --model PATH --input FILE [--output NONE]
-  stanford.py --tool=neragger --jar FILE --model PATH --input FILE  [--output NONE]
-  stanford.py --tool=lexparser --jar FILE --modeljar FILE --model PATH --input FILE [--output NONE]
+  stanford.py --tool=postagger --jar FILE --model PATH --input FILE [--output NONE] [options]
+  stanford.py --tool=neragger --jar FILE --model PATH --input FILE  [--output NONE] [options]
+  stanford.py --tool=lexparser --jar FILE --modeljar FILE --model PATH --input FILE [--output NONE] [options]
   stanford.py (-h | --help)
   stanford.py --version
   
-  stanford.py --postag FILE [--lang LANG] [--output NONE]
-  stanford.py --lexparse FILE [--lang LANG] [--output NONE]
-  stanford.py --nertag FILE [--lang LANG] [--output NONE] 
+  stanford.py --postag FILE [--lang LANG] [--output NONE] [options]
+  stanford.py --lexparse FILE [--lang LANG] [--output NONE] [options]
+  stanford.py --nertag FILE [--lang LANG] [--output NONE] [options] 
   
-  stanford.py --postag FILE [--model PATH] [--output NONE]
-  stanford.py --lexparse FILE [--model PATH] [--output NONE]
-  stanford.py --nertag FILE [--model LANG] [--output NONE] 
+  stanford.py --postag FILE [--model PATH] [--output NONE] [options]
+  stanford.py --lexparse FILE [--model PATH] [--output NONE] [options]
+  stanford.py --nertag FILE [--model LANG] [--output NONE] [options] 
+  
+  stanford.py --tools TOOLS FILE [--lang LANG] [--output NONE] [options]
+  
+  stanford.py --profile TOOL FILE [--lang LANG] [--sample N] [--agreement F] [--reference MODEL] [--save FILE]
   
 Options:
   -h --help     Show this screen.
@@ -29,12 +33,43 @@ Options:
   --nertag      TL;DR, "I just want to NER tag this file" (only English).
   --lexparse    TL;DR, "I just want to parse this file" [default: eng].
   --lang		The language option for TL;DR options [default: eng].
+  --timeout SECS  Kill and bisect a batch that takes longer than SECS seconds.
+  --reject FILE   Write the sentences the tool fails on to FILE (else stderr).
+  --bucket-window N  Sort N sentences at a time by length, longest first, before batching.
+  --max-parse-length N  Send sentences longer than N tokens to the fallback parser.
+  --fallback MODEL  Fallback for long sentences, a model from lexparser_languages
+                    or 'flat' for a flat tree [default: PCFG].
+  --tools TOOLS   Comma-separated tools run side by side on the same input, e.g.
+                  postagger,nertagger,lexparser; one tab-separated record per sentence.
+  --profile TOOL  Profile every installed TOOL model for --lang on a sample of FILE.
+  --sample N      Number of sentences to profile on [default: 200].
+  --agreement F   Minimum tag agreement with the reference model [default: 0.97].
+  --reference MODEL  Reference model name (default: first model in the language table).
+  --save FILE     Save the recommended model to a JSON config FILE.
+  --config FILE   Use the models recommended in a JSON config FILE by --profile.
+  --governor      Size the JVM heap and batches from the available memory and 
+                  shrink the batches under memory pressure.
+  --follow        Keep reading lines as they are appended to FILE (use FILE - for STDIN).
+  --flush-lines N  Tag a micro-batch of a --follow/STDIN stream every N lines [default: 100].
+  --flush-ms T    ... or every T milliseconds, whichever comes first [default: 200].
+  --prefilter     Only NER tag the sentences with entity candidates, the rest are all 'O'.
+  --candidate-regex REGEX  A token matching REGEX is an entity candidate 
+                  (default: any token with an uppercase letter or digit).
+  --gazetteer FILE  Tokens in FILE (one entry per line) are entity candidates.
+  --audit         NER tag the skipped sentences too and report the recall loss.
+  --report        Report the throughput and time to first output on STDERR.
 """
 
 from __future__ import print_function
 import io
+import json
 import os
 import re
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 
 from nltk.tag.stanford import StanfordPOSTagger, StanfordNERTagger
@@ -44,6 +79,8 @@ from nltk.parse.stanford import StanfordParser
 
 from docopt import docopt
 
+import pipeline
+
 
 taggers = {
 'postagger': StanfordPOSTagger, 
@@ -109,24 +146,64 @@ nertagger_languages = {
 }
 
 def stanford_tag_sents(sentences, tagger):
-	tagged_sents = tagger.tag_sents(sentences)
-	for sent in tagged_sents:
-		yield " ".join(word + '#' + pos for word, pos in sent)
+	tagged_batch = pipeline.TaggedBatch(pipeline.consume(tagger.tag_sents(sentences)))
+	for tagged_sent in tagged_batch.formatted():
+		yield tagged_sent
 
 def stanford_parse_sents(sentences, parser):
 	parsed_sents = sum([list(i) for i in parser.parse_sents(sentences)], [])
 	return [re.sub(' +',' ', str(sent).replace('\n', '')) for sent in parsed_sents]
 
+def flat_tree(tokens):
+	"""
+	A flat parse in the same format as stanford_parse_sents(), for sentences 
+	that are too long to parse.
+	"""
+	tokens = [token.replace('(', '-LRB-').replace(')', '-RRB-') for token in tokens]
+	return "(ROOT (X " + " ".join("(X " + token + ")" for token in tokens) + "))"
+
+def resolve_lang(lang):
+	"""
+	The language code to use for lang, no language means English.
+	"""
+	return lang or 'eng'
+
+def fallback_model(lang, fallback='PCFG', model=None):
+	"""
+	Resolves the --fallback option to a lexparser model name, by default the 
+	first PCFG model of the language; returns None if a flat tree is wanted.
+	Raises a ValueError if the language has no such model or if it's the 
+	lexparser's own model, i.e. the --model path given as model.
+	"""
+	if fallback == 'flat':
+		return None
+	models = lexparser_languages[lang]
+	if fallback == 'PCFG':
+		fallback = next((name for name in models if 'PCFG' in name), None)
+		if fallback is None:
+			raise ValueError('There is no PCFG lexparser model for ' + lang + 
+							', use --fallback flat or one of: ' + ', '.join(models))
+	elif fallback not in models:
+		raise ValueError(fallback + ' is not a lexparser model for ' + lang + 
+						', use --fallback flat or one of: ' + ', '.join(models))
+	if model and os.path.basename(model) == fallback:
+		raise ValueError('The fallback ' + fallback + ' is the lexparser\'s own model, '
+						'use --fallback flat or another one of: ' + ', '.join(models))
+	return fallback
+
 def initialize_tool(arguments):
 	"""
 	To initalize the Stanford tools given the users arguments from command line.
 	"""
 	tool_name = arguments['--tool']
+	java_options = {}
+	if arguments.get('--java-options'):
+		java_options['java_options'] = arguments['--java-options']
 	if tool_name in taggers:
-		tagger = taggers[tool_name](model_filename=arguments['--model'], path_to_jar=arguments['--jar'])
+		tagger = taggers[tool_name](model_filename=arguments['--model'], path_to_jar=arguments['--jar'], **java_options)
 		return tagger, stanford_tag_sents
 	elif tool_name in parsers:
-		parser = parsers[tool_name](model_path=arguments['--model'], path_to_models_jar=arguments['--modeljar'], path_to_jar=arguments['--jar'])
+		parser = parsers[tool_name](model_path=arguments['--model'], path_to_models_jar=arguments['--modeljar'], path_to_jar=arguments['--jar'], **java_options)
 		return parser, stanford_parse_sents
 								
 
@@ -142,55 +219,524 @@ def initialize_iofiles(arugments):
 	
 def augment_arugments(arguments):
 	homedir = os.path.expanduser("~")
+	arguments['--lang'] = resolve_lang(arguments.get('--lang'))
 	# Augment arugments for LexParser.
 	if '--lexparse' in arguments.keys() and arguments['--lexparse']:
 		arguments['--tool']	= 'lexparser'
 		arguments['--jar']	= homedir +'/stanford-parser/stanford-parser.jar'
 		arguments['--modeljar']	= homedir +'/stanford-parser/stanford-parser-3.5.2-models.jar'
 		if arguments['--model'] is None:		
-			if arguments['--lang'] == None:
-				arguments['--model'] = 'edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz'
-			else:
-				arguments['--model'] = 'edu/stanford/nlp/models/lexparser/' 
-				arguments['--model']+= lexparser_languages[arguments['--lang']][0]
+			arguments['--model'] = 'edu/stanford/nlp/models/lexparser/' 
+			arguments['--model']+= lexparser_languages[arguments['--lang']][0]
 	# Augment arugments for POSTagger.
 	elif '--postag' in arguments.keys() and arguments['--postag']:
 		arguments['--tool']	= 'postagger'
 		arguments['--jar']	= homedir +'/stanford-postagger/stanford-postagger.jar'
 		if arguments['--model'] is None:	
-			if arguments['--lang'] == None:
-				arguments['--model'] = homedir + '/stanford-postagger/models/english-bidirectional-distsim.tagger'
-			else:
-				arguments['--model'] =  homedir + '/stanford-postagger/models/'
-				arguments['--model']+= postagger_languages[arguments['--lang']][0]
+			arguments['--model'] =  homedir + '/stanford-postagger/models/'
+			arguments['--model']+= postagger_languages[arguments['--lang']][0]
 	# Augment arugments for NERTagger.
 	elif '--nertag' in arguments.keys() and arguments['--nertag']:
 		arguments['--tool']	= 'nertagger'
 		arguments['--jar']	= homedir +'/stanford-ner/stanford-ner.jar'
 		if arguments['--model'] is None:
-			if arguments['--lang'] == None:
-				arguments['--model'] = homedir + '/stanford-ner/classifiers/english.all.3class.distsim.crf.ser.gz'
-			else:
-				arguments['--model'] =  homedir + '/stanford-ner/classifiers/'
-				arguments['--model']+= nertagger_languages[arguments['--lang']][0]
-		
+			arguments['--model'] =  homedir + '/stanford-ner/classifiers/'
+			arguments['--model']+= nertagger_languages[arguments['--lang']][0]
+
+
+def available_memory_mb():
+	"""
+	The memory available for new processes, from /proc/meminfo on Linux.
+	"""
+	try:
+		with io.open('/proc/meminfo', 'r') as fin:
+			meminfo = dict(line.split(':', 1) for line in fin)
+		return int(meminfo['MemAvailable'].split()[0]) / 1024.0
+	except (IOError, KeyError, ValueError):
+		pass
+	try:
+		return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES') / 1024.0 ** 2
+	except (ValueError, OSError):
+		# Mac OS X has no SC_AVPHYS_PAGES, go by the physical memory.
+		return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024.0 ** 2
+
+def command_line(pid):
+	"""
+	The command line of a process, '' if it's gone or /proc isn't available.
+	"""
+	try:
+		with io.open('/proc/' + str(pid) + '/cmdline', 'rb') as fin:
+			return fin.read().replace(b'\0', b' ').decode('utf8', 'replace')
+	except IOError:
+		return ''
+
+def subprocess_rss_mb(pid=None, match=None):
+	"""
+	The total RSS of the descendants of pid (by default this process), i.e. 
+	the JVMs started by the Stanford tools; 0 where /proc isn't available.
+	With match, only the descendants with match in their command line (and 
+	their own descendants) are counted, e.g. the JVMs of one tool's jar.
+	"""
+	children, rss = {}, {}
+	pagesize = os.sysconf('SC_PAGE_SIZE')
+	for proc in os.listdir('/proc') if os.path.isdir('/proc') else []:
+		if not proc.isdigit():
+			continue
+		try:
+			with io.open('/proc/' + proc + '/stat', 'r') as fin:
+				# The process name may contain spaces, the fields after it don't.
+				fields = fin.read().rsplit(')', 1)[1].split()
+		except (IOError, IndexError, ValueError):
+			continue
+		children.setdefault(int(fields[1]), []).append(int(proc))
+		rss[int(proc)] = int(fields[21]) * pagesize
+	total = 0
+	stack = [(child, match is None) for child in children.get(pid or os.getpid(), [])]
+	while stack:
+		child, matched = stack.pop()
+		matched = matched or match in command_line(child)
+		if matched:
+			total += rss.get(child, 0)
+		stack.extend((grandchild, matched) for grandchild in children.get(child, []))
+	return total / 1024.0 ** 2
+
+
+class ResourceGovernor(object):
+	"""
+	Sizes the JVM heap (java_options) and the batch size from the available 
+	memory and the input size, then adapts the batch size to the measured 
+	per-sentence memory cost of the JVM. While a batch runs, the JVM's RSS and
+	the available memory are watched; under memory pressure, or when the JVM 
+	dies with an OutOfMemoryError, the batches are halved instead of crashing.
+	Other errors are raised as they are, e.g. for the watchdog to bisect.
+
+	After an out-of-memory failure the batch size stays below the failed one 
+	until recovery batches in a row have succeeded.
+
+	If jar is given, only the JVMs with the jar on their command line are 
+	measured, e.g. to leave out the JVMs of other tools running alongside.
+
+	The JVM's RSS is compared against the heap plus non_heap_mb for the 
+	memory it uses outside the heap (metaspace, code cache, thread stacks).
+	The per-sentence cost leaves out the JVM's fixed footprint (the model 
+	etc.), which is estimated from the peaks of the first batch and the next 
+	batch of another size.
+	"""
+	def __init__(self, input_size=None, memory_fraction=0.5, min_heap_mb=256, 
+				max_batch_size=10000, interval=0.1, recovery=3, jar=None,
+				non_heap_mb=256):
+		self.heap_mb = max(min_heap_mb, int(available_memory_mb() * memory_fraction))
+		self.java_options = '-mx' + str(self.heap_mb) + 'm'
+		self.rss_limit_mb = self.heap_mb + non_heap_mb
+		self.max_batch_size = min(max_batch_size, input_size or max_batch_size)
+		# A conservative guess until two batches are measured.
+		self.sentence_mb, self.footprint_mb = 1.0, 0.0
+		self.first_peak = None
+		self.ceiling, self.successes, self.recovery = None, 0, recovery
+		self.batch_size = self.fit_batch_size()
+		self.interval = interval
+		self.jar = jar
+		self.pressure = False
+
+	def fit_batch_size(self):
+		"""
+		The number of sentences that fits in 80% of the JVM's memory, next to 
+		its footprint.
+		"""
+		return max(1, min(self.max_batch_size, self.ceiling or self.max_batch_size,
+						int((0.8 * self.rss_limit_mb - self.footprint_mb) / self.sentence_mb)))
+
+	def shrink(self, batch_size):
+		self.batch_size = max(1, batch_size // 2)
+		self.pressure = False
+
+	def watch(self, stop, peak):
+		"""
+		Samples the JVM's RSS into peak[0] until stop is set.
+		"""
+		while not stop.wait(self.interval):
+			peak[0] = max(peak[0], subprocess_rss_mb(match=self.jar))
+			if (available_memory_mb() < 0.05 * self.heap_mb or 
+				peak[0] > 0.95 * self.rss_limit_mb):
+				self.pressure = True
+
+	def measure(self, batch_size, peak_mb):
+		"""
+		Updates the per-sentence cost and the footprint from the peak RSS of 
+		a batch, as the slope and intercept of the line through the first 
+		batch's peak and this one. After the first batch alone, its whole peak
+		counts as the cost of its sentences, an upper bound.
+		"""
+		if self.first_peak is None:
+			self.first_peak = (batch_size, peak_mb)
+			self.sentence_mb = peak_mb / batch_size
+			return
+		first_size, first_peak_mb = self.first_peak
+		if batch_size == first_size:
+			return
+		self.sentence_mb = max(0.01, (peak_mb - first_peak_mb) / (batch_size - first_size))
+		self.footprint_mb = max(0.0, first_peak_mb - self.sentence_mb * first_size)
+
+	def process(self, batch, process_batch):
+		"""
+		Runs process_batch() over the batch in governed sub-batches.
+		"""
+		processed_sents = []
+		start = 0
+		while start < len(batch):
+			sub_batch = batch[start:start + self.batch_size]
+			stop, peak = threading.Event(), [0.0]
+			watcher = threading.Thread(target=self.watch, args=(stop, peak))
+			watcher.daemon = True
+			watcher.start()
+			error = None
+			try:
+				processed_sents += process_batch(sub_batch)
+			except Exception as e:
+				error = e
+			finally:
+				stop.set()
+				watcher.join()
+			if error is not None:
+				out_of_memory = self.pressure or 'OutOfMemoryError' in str(error)
+				self.pressure = False
+				if len(sub_batch) == 1 or not out_of_memory:
+					raise error
+				# Don't grow back to the batch size the JVM died on for a while.
+				self.ceiling, self.successes = len(sub_batch) - 1, 0
+				self.shrink(len(sub_batch))
+				continue
+			start += len(sub_batch)
+			self.successes += 1
+			if self.ceiling is not None and self.successes >= self.recovery:
+				self.ceiling = None
+			if self.pressure:
+				self.shrink(len(sub_batch))
+			elif peak[0] > 0:
+				self.measure(len(sub_batch), peak[0])
+				# Grow at most twofold per batch.
+				self.batch_size = min(2 * len(sub_batch), self.fit_batch_size())
+		return processed_sents
+
+
+tldr_options = {
+'postagger': '--postag',
+'nertagger': '--nertag',
+'lexparser': '--lexparse'
+}
+
+
+class Pipeline(pipeline.Pipeline):
+	"""
+	A Stanford tool that can be reused across many calls, e.g.
+
+		>>> pipeline = Pipeline('postagger', lang='eng')
+		>>> list(pipeline.run(['This is a sentence .']))
+		['This#DT is#VBZ a#DT sentence#NN .#.']
+
+	NLTK still starts a new JVM for every batch, see pipeline.py.
+	When jar is not given, the TL;DR defaults from augment_arugments() are used.
+	Other options (batch_size, timeout, reject, bucket_window) go to 
+	pipeline.Pipeline; the lexparser buckets 10 batches at a time by default.
+
+	For the lexparser, sentences longer than max_parse_length tokens are 
+	parsed with the cheaper fallback model instead (see fallback_model()).
+
+	With governor=True (or a ResourceGovernor), a ResourceGovernor sizes the 
+	JVM heap and the batches, input_size (the number of sentences or an upper
+	bound, if known) caps the batch size. Note that with a timeout, the 
+	batches run in child processes and what the governor measures there 
+	doesn't carry over to the next batch.
+	"""
+	def __init__(self, tool, model=None, lang=None, jar=None, modeljar=None, 
+				max_parse_length=None, fallback='PCFG', governor=False, 
+				input_size=None, **options):
+		lang = resolve_lang(lang)
+		arguments = {'--tool': tool, '--model': model, '--lang': lang,
+					'--jar': jar, '--modeljar': modeljar}
+		if jar is None:
+			arguments[tldr_options[tool]] = True
+			augment_arugments(arguments)
+		self.governor = None
+		if isinstance(governor, ResourceGovernor):
+			self.governor = governor
+		elif governor:
+			self.governor = ResourceGovernor(input_size)
+		if self.governor is not None:
+			arguments['--java-options'] = self.governor.java_options
+			if self.governor.jar is None:
+				self.governor.jar = arguments['--jar']
+			options['batch_size'] = self.governor.batch_size
+		if options.get('prefilter') and tool != 'nertagger':
+			raise ValueError('The NER prefilter only works with the nertagger.')
+		self.arguments = arguments
+		_tool, process = initialize_tool(arguments)
+		if tool in parsers:
+			options.setdefault('bucket_window', 10 * options.get('batch_size', 1000))
+		super(Pipeline, self).__init__(_tool, process, **options)
+		self.max_parse_length = max_parse_length
+		self.fallback_parser = None
+		if tool in parsers and max_parse_length is not None:
+			fallback = fallback_model(lang, fallback, arguments['--model'])
+			if fallback:
+				fallback_arguments = dict(arguments)
+				fallback_arguments['--model'] = 'edu/stanford/nlp/models/lexparser/' + fallback
+				self.fallback_parser, _ = initialize_tool(fallback_arguments)
+
+	def warmup_files(self):
+		return [self.arguments[option] for option in ('--jar', '--modeljar', '--model')
+				if self.arguments.get(option) and os.path.isfile(self.arguments[option])]
+
+	def process_batch(self, batch):
+		if self.governor is None:
+			return self.process_batch_ungoverned(batch)
+		processed_sents = self.governor.process(batch, self.process_batch_ungoverned)
+		self.batch_size = self.governor.batch_size
+		return processed_sents
+
+	def process_batch_ungoverned(self, batch):
+		if self.max_parse_length is None or self.arguments['--tool'] not in parsers:
+			return super(Pipeline, self).process_batch(batch)
+		too_long = [len(sent) > self.max_parse_length for sent in batch]
+		short_sents = [sent for sent, is_long in zip(batch, too_long) if not is_long]
+		long_sents = [sent for sent, is_long in zip(batch, too_long) if is_long]
+		parsed_short = iter(super(Pipeline, self).process_batch(short_sents) 
+							if short_sents else [])
+		if self.fallback_parser is None:
+			parsed_long = iter([flat_tree(sent) for sent in long_sents])
+		else:
+			parsed_long = iter(self.process(long_sents, self.fallback_parser) 
+							if long_sents else [])
+		return [next(parsed_long) if is_long else next(parsed_short) 
+				for is_long in too_long]
+
+
+class MultiPipeline(pipeline.Pipeline):
+	"""
+	Runs several Stanford tools over the same input at the same time, e.g.
+
+		>>> pipeline = MultiPipeline(['postagger', 'nertagger', 'lexparser'])
+
+	The input is read and tokenized once and every window of sentences goes 
+	to all the tools' pipelines concurrently, one JVM each; the outputs are
+	joined into one tab-separated record per sentence, in the order of tools.
+	The TL;DR models are used unless models maps a tool to its --model.
+	"""
+	def __init__(self, tools, lang=None, models=None, governor=False, 
+				input_size=None, **options):
+		models = models or {}
+		if options.get('reject'):
+			# One reject file for all the tools, each record names its tool.
+			options['reject'] = pipeline.RejectLog(options['reject'])
+		self.pipelines = []
+		for tool in tools:
+			tool_options = dict(options, name=tool)
+			if tool != 'nertagger':
+				tool_options.pop('prefilter', None)
+			if governor:
+				# The JVMs share the memory, each governor measures its own.
+				tool_options['governor'] = ResourceGovernor(input_size, 
+											memory_fraction=0.5 / len(tools))
+			self.pipelines.append(Pipeline(tool, model=models.get(tool), 
+										lang=lang, **tool_options))
+		super(MultiPipeline, self).__init__(None, None, 
+						batch_size=options.get('batch_size', 1000),
+						bucket_window=max(stanford_pipeline.bucket_window or 
+										stanford_pipeline.batch_size 
+										for stanford_pipeline in self.pipelines),
+						prefilter=options.get('prefilter') if 'nertagger' in tools else None)
+		self.executor = ThreadPoolExecutor(len(self.pipelines))
+
+	def process_window(self, window, offset=0):
+		futures = [self.executor.submit(stanford_pipeline.process_window, window, offset) 
+					for stanford_pipeline in self.pipelines]
+		columns = [future.result() for future in futures]
+		return ["\t".join(record) for record in zip(*columns)]
+
+	def start_warmup(self):
+		for stanford_pipeline in self.pipelines:
+			stanford_pipeline.start_warmup()
+
+
+model_languages = {
+'postagger': postagger_languages,
+'nertagger': nertagger_languages,
+'lexparser': lexparser_languages
+}
+
+def model_argument(tool, model_name):
+	"""
+	The --model value for a model name from the language tables.
+	"""
+	homedir = os.path.expanduser("~")
+	if tool == 'postagger':
+		return homedir + '/stanford-postagger/models/' + model_name
+	elif tool == 'nertagger':
+		return homedir + '/stanford-ner/classifiers/' + model_name
+	elif tool == 'lexparser':
+		return 'edu/stanford/nlp/models/lexparser/' + model_name
+
+def installed_models(tool, lang):
+	"""
+	The models of the language table for tool that are installed in $HOME.
+	"""
+	models = model_languages[tool][lang]
+	if tool == 'lexparser':
+		modeljar = os.path.expanduser("~") + '/stanford-parser/stanford-parser-3.5.2-models.jar'
+		if not os.path.isfile(modeljar):
+			return []
+		with zipfile.ZipFile(modeljar) as jar:
+			packed = set(jar.namelist())
+		return [model for model in models if model_argument(tool, model) in packed]
+	return [model for model in models if os.path.isfile(model_argument(tool, model))]
+
+def timed_run(stanford_pipeline, sentences):
+	"""
+	Returns the outputs, the seconds taken and the peak RSS in MB of the 
+	tool's subprocesses (i.e. the JVM); run it in a fresh child process, e.g. 
+	with pipeline.run_with_timeout(), so the peak belongs to this run only.
+	"""
+	import resource # Not available on Windows, only needed to profile.
+	start = time.time()
+	processed_sents = list(stanford_pipeline.run(sentences))
+	seconds = time.time() - start
+	peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+	# ru_maxrss is in bytes on Mac OS X and in kilobytes elsewhere.
+	peak_rss /= 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+	return processed_sents, seconds, peak_rss
+
+def agreement(processed_sents, reference_sents):
+	"""
+	The proportion of tokens with the same tag as the reference, or of 
+	identical trees for the lexparser's outputs.
+	"""
+	same, total = 0, 0
+	for processed_sent, reference_sent in zip(processed_sents, reference_sents):
+		if processed_sent.startswith('('):
+			same, total = same + (processed_sent == reference_sent), total + 1
+			continue
+		tokens, reference_tokens = processed_sent.split(), reference_sent.split()
+		same += sum(token == reference_token for token, reference_token 
+					in zip(tokens, reference_tokens))
+		total += max(len(tokens), len(reference_tokens))
+	return same / float(total) if total else 1.0
+
+def profile_models(tool, lang, sentences, reference=None):
+	"""
+	Runs every installed model of the tool for the language on the sentences,
+	returns a list of dicts with the model's sentences/sec, peak memory and 
+	agreement with the reference model's outputs, reference model first.
+	"""
+	models = installed_models(tool, lang)
+	if not models:
+		raise LookupError('No ' + tool + ' models installed for ' + lang)
+	reference = reference if reference in models else models[0]
+	models.remove(reference)
+	profiles, reference_sents = [], None
+	for model in [reference] + models:
+		stanford_pipeline = Pipeline(tool, model=model_argument(tool, model), lang=lang)
+		processed_sents, seconds, peak_rss = pipeline.run_with_timeout(
+									timed_run, (stanford_pipeline, sentences), None)
+		if reference_sents is None:
+			reference_sents = processed_sents
+		profiles.append({'model': model,
+						'sents_per_sec': len(sentences) / seconds,
+						'peak_rss_mb': peak_rss,
+						'agreement': agreement(processed_sents, reference_sents)})
+	return profiles
+
+def recommend_model(profiles, threshold):
+	"""
+	The fastest profiled model whose agreement meets the threshold.
+	"""
+	return max((profile for profile in profiles if profile['agreement'] >= threshold),
+				key=lambda profile: profile['sents_per_sec'])
+
+def save_config(configfile, tool, lang, model):
+	"""
+	Saves the --model to use for a tool into a JSON config for --config.
+	"""
+	config = {}
+	if os.path.isfile(configfile):
+		with io.open(configfile, 'r', encoding='utf8') as fin:
+			config = json.load(fin)
+	config[tool] = {'lang': lang, 'model': model_argument(tool, model)}
+	with io.open(configfile, 'w', encoding='utf8') as fout:
+		fout.write(json.dumps(config, indent=2, sort_keys=True))
+
+def load_config(configfile):
+	with io.open(configfile, 'r', encoding='utf8') as fin:
+		return json.load(fin)
+
+def apply_config(arguments):
+	"""
+	Sets the --model and --lang from a JSON config saved by save_config(), 
+	unless a --model is given or the config is for another --lang.
+	"""
+	config = load_config(arguments['--config'])
+	tool = arguments['--tool'] or next((tool for tool, option in tldr_options.items() 
+										if arguments[option]), None)
+	if (tool in config and arguments['--model'] is None and 
+		arguments['--lang'] in (None, config[tool]['lang'])):
+		arguments['--model'] = config[tool]['model']
+		arguments['--lang'] = config[tool]['lang']
+
+def input_size(infile, follow=False):
+	"""
+	An upper bound on the number of sentences in the input without reading 
+	it: its size in bytes, or None for STDIN and files that keep growing.
+	"""
+	if infile == '-' or follow:
+		return None
+	return os.path.getsize(infile)
+
+def profile_command(arguments):
+	"""
+	Prints the profile of every installed model and the recommended one.
+	"""
+	tool, lang = arguments['--profile'], resolve_lang(arguments['--lang'])
+	with io.open(arguments['FILE'], 'r', encoding='utf8') as fin:
+		sentences = [line.split() for _, line in zip(range(int(arguments['--sample'])), fin)]
+	reference = arguments['--reference']
+	profiles = profile_models(tool, lang, sentences, reference)
+	print('\t'.join(['model', 'sents/sec', 'peak MB', 'agreement']))
+	for profile in profiles:
+		print('{model}\t{sents_per_sec:.2f}\t{peak_rss_mb:.0f}\t{agreement:.4f}'.format(**profile))
+	recommended = recommend_model(profiles, float(arguments['--agreement']))
+	print('Recommended: ' + recommended['model'])
+	if arguments['--save']:
+		save_config(arguments['--save'], tool, lang, recommended['model'])
 
 if __name__ == '__main__':
 	arguments = docopt(__doc__, version='NLTK CLI (Stanford Tools) version 0.0.1')
-	# Augment arguments for TL;DR commands.
-	if arguments['--tool'] is None:
-		augment_arugments(arguments)
-		
-	tool, process = initialize_tool(arguments)
+	if arguments['--profile']:
+		profile_command(arguments)
+		sys.exit()
 	infile, outfile = initialize_iofiles(arguments)
-	if outfile:
-		fout = io.open(outfile, 'w', encoding='utf8')
-	with io.open(infile, 'r', encoding='utf8') as fin:
-		sentences = [line.strip().split() for line in fin]
-		for processed_sent in process(sentences, tool):
-			if outfile:
-				fout.write(processed_sent + '\n')
-			else:
-				print(processed_sent)
-
-
+	stanford_options = pipeline.pipeline_options(arguments)
+	stanford_options['max_parse_length'] = (arguments['--max-parse-length'] and 
+											int(arguments['--max-parse-length']))
+	stanford_options['fallback'] = arguments['--fallback'] or 'PCFG'
+	stanford_options['governor'] = arguments['--governor']
+	stanford_options['input_size'] = input_size(infile, arguments['--follow'])
+	if arguments['--tools']:
+		models = {}
+		if arguments['--config']:
+			models = dict((tool, config['model']) for tool, config 
+						in load_config(arguments['--config']).items())
+		stanford_pipeline = MultiPipeline(arguments['--tools'].split(','), 
+										lang=arguments['--lang'], models=models,
+										**stanford_options)
+	else:
+		# Augment arguments for TL;DR commands.
+		if arguments['--config']:
+			apply_config(arguments)
+		if arguments['--tool'] is None:
+			augment_arugments(arguments)
+		stanford_pipeline = Pipeline(arguments['--tool'], 
+									model=arguments['--model'], 
+									jar=arguments['--jar'], 
+									modeljar=arguments['--modeljar'],
+									lang=arguments['--lang'],
+									**stanford_options)
+	pipeline.run_command(stanford_pipeline, infile, outfile, arguments)